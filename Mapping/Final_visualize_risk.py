@@ -2,13 +2,23 @@ import geopandas as gpd
 import folium
 from folium import plugins
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import pandas as pd
 import os
-from shapely.geometry import Polygon, LineString, MultiLineString, Point
-from shapely.ops import unary_union, polygonize
-from collections import defaultdict
+import orjson
+import shapely
+from shapely.geometry import MultiLineString
+from shapely.ops import polygonize
+from joblib import Parallel, delayed
+from numba import njit
+from scipy.spatial import ConvexHull, QhullError
+from vector_tiles import (
+    VECTOR_TILE_THRESHOLD, vector_tiles_available, write_vector_tiles, add_vector_tile_layer
+)
+from risk_metrics import (
+    pct_rank, category_codes, CATEGORY_NAMES, CATEGORY_COLORS, NO_DATA_CATEGORY, NO_DATA_COLOR
+)
+
+# Per-building diagnostics from the footprint extractor (one line per step)
+VERBOSE = False
 
 # Read the GeoJSON file - UPDATE THIS PATH
 possible_paths = [
@@ -17,33 +27,87 @@ possible_paths = [
     "../Output/Data/residential_buildings_only.geojson"
 ]
 
-gdf = None
+input_path = None
 for path in possible_paths:
     if os.path.exists(path):
         print(f"Found file at: {path}")
-        gdf = gpd.read_file(path)
+        input_path = path
         break
 
-if gdf is None:
+if input_path is None:
     print("ERROR: Could not find the GeoJSON file. Please update the path in the script.")
     print("Searched paths:", possible_paths)
     exit(1)
 
+# Extracted 2D footprints are cached next to the input as GeoParquet, keyed by
+# the input file's modification time, so re-runs skip the 3D -> 2D conversion
+cache_path = input_path + '.2d.parquet'
+cache_meta = input_path + '.2d.meta'
+input_mtime = str(os.path.getmtime(input_path))
+use_cache = False
+if os.path.exists(cache_path) and os.path.exists(cache_meta):
+    with open(cache_meta) as f:
+        use_cache = f.read() == input_mtime
+
+if use_cache:
+    print(f"Using cached 2D footprints: {cache_path}")
+    gdf = gpd.read_parquet(cache_path)
+else:
+    gdf = gpd.read_file(input_path, engine='pyogrio')
+
 print(f"\nOriginal data loaded: {len(gdf)} features")
 print(f"Geometry types: {gdf.geometry.geom_type.value_counts().to_dict()}")
 
 # Inspect first geometry to understand structure
-sample_geom = gdf.geometry.iloc[0]
-print(f"\nInspecting first building geometry:")
-print(f"  Type: {sample_geom.geom_type}")
-if isinstance(sample_geom, MultiLineString):
-    print(f"  Number of line segments: {len(sample_geom.geoms)}")
-    if len(sample_geom.geoms) > 0:
-        first_line = sample_geom.geoms[0]
-        print(f"  First segment has {len(first_line.coords)} points")
-        first_coord = list(first_line.coords)[0]
-        print(f"  Coordinate example: {first_coord}")
-        print(f"  Has Z coordinate: {len(first_coord) > 2}")
+if not use_cache:
+    sample_geom = gdf.geometry.iloc[0]
+    print(f"\nInspecting first building geometry:")
+    print(f"  Type: {sample_geom.geom_type}")
+    if isinstance(sample_geom, MultiLineString):
+        print(f"  Number of line segments: {len(sample_geom.geoms)}")
+        if len(sample_geom.geoms) > 0:
+            first_line = sample_geom.geoms[0]
+            print(f"  First segment has {len(first_line.coords)} points")
+            first_coord = list(first_line.coords)[0]
+            print(f"  Coordinate example: {first_coord}")
+            print(f"  Has Z coordinate: {len(first_coord) > 2}")
+
+@njit(cache=True)
+def _ground_mask(edges, min_z, tolerance):
+    """
+    Flag edges whose two endpoints both lie within tolerance of min_z.
+    
+    edges is a float64 (M, 2, 3) array of edge start/end points. Returns the
+    boolean mask and the squared 2D length of every edge.
+    """
+    n_edges = edges.shape[0]
+    mask = np.empty(n_edges, dtype=np.bool_)
+    len2 = np.empty(n_edges, dtype=np.float64)
+    for i in range(n_edges):
+        mask[i] = (abs(edges[i, 0, 2] - min_z) < tolerance and
+                   abs(edges[i, 1, 2] - min_z) < tolerance)
+        dx = edges[i, 0, 0] - edges[i, 1, 0]
+        dy = edges[i, 0, 1] - edges[i, 1, 1]
+        len2[i] = dx * dx + dy * dy
+    return mask, len2
+
+def _convex_hull_ring(points_2d):
+    """Closed convex hull ring of unique (N, 2) points, or None if degenerate."""
+    if len(points_2d) < 3:
+        return None
+    try:
+        hull = ConvexHull(points_2d)
+    except QhullError:
+        return None  # All points collinear
+    return points_2d[np.append(hull.vertices, hull.vertices[0])]
+
+def _polygon_rings(polygon):
+    """Shell and hole coordinates of a polygon (largest part if a MultiPolygon)."""
+    if polygon.geom_type == 'MultiPolygon':
+        polygon = max(polygon.geoms, key=lambda p: p.area)
+    return [shapely.get_coordinates(polygon.exterior)] + [
+        shapely.get_coordinates(ring) for ring in polygon.interiors
+    ]
 
 def extract_2d_footprint_from_3d_multilinestring(geom):
     """
@@ -55,6 +119,9 @@ def extract_2d_footprint_from_3d_multilinestring(geom):
     1. Collect all unique points at ground level
     2. Find which segments connect to form the ground footprint
     3. Create a polygon from those segments
+    
+    Returns the footprint as a list of ring coordinate arrays (shell first,
+    then holes) so all polygons can be constructed in bulk, or None.
     """
     if geom is None or geom.is_empty:
         return None
@@ -63,63 +130,52 @@ def extract_2d_footprint_from_3d_multilinestring(geom):
         if not isinstance(geom, MultiLineString):
             return None
         
-        # Collect all points with their Z values
-        all_points_3d = []
-        all_segments_2d = []
+        # Pull every edge vertex in one bulk call instead of walking the
+        # LineStrings point by point
+        if not shapely.has_z(geom):
+            return None
         
-        for line in geom.geoms:
-            coords = list(line.coords)
-            # Each segment typically has 2 points (start, end)
-            for coord in coords:
-                if len(coord) >= 3:
-                    all_points_3d.append(coord)
-                    
-        if not all_points_3d:
+        lines = shapely.get_parts(geom)
+        n_coords = shapely.get_num_coordinates(lines)
+        lines = lines[n_coords >= 2]
+        n_coords = n_coords[n_coords >= 2]
+        if len(lines) == 0:
             return None
         
+        coords = shapely.get_coordinates(lines, include_z=True)
+        
         # Find the minimum Z (ground level)
-        z_values = [p[2] for p in all_points_3d]
-        min_z = min(z_values)
+        z_values = coords[:, 2]
+        min_z = z_values.min()
         tolerance = 0.5  # Allow small floating point differences
         
-        print(f"    Z range: {min_z:.2f} to {max(z_values):.2f}, using ground level: {min_z:.2f}")
+        if VERBOSE:
+            print(f"    Z range: {min_z:.2f} to {z_values.max():.2f}, using ground level: {min_z:.2f}")
+        
+        # Start and end point of every edge, shape (M, 2, 3)
+        ends = np.cumsum(n_coords)
+        edges = np.stack([coords[ends - n_coords], coords[ends - 1]], axis=1)
+        
+        # Ground edges have both endpoints at ground level; ignore zero-length ones
+        on_ground, seg_len2 = _ground_mask(edges, min_z, tolerance)
+        edges_2d = edges[on_ground & (seg_len2 > 1e-20)][:, :, :2]
         
         # Collect all 2D segments at ground level
-        ground_segments = []
-        for line in geom.geoms:
-            coords = list(line.coords)
-            if len(coords) >= 2:
-                # Check if both endpoints are at ground level
-                p1 = coords[0]
-                p2 = coords[-1]
-                
-                if len(p1) >= 3 and len(p2) >= 3:
-                    z1, z2 = p1[2], p2[2]
-                    
-                    # If both points are at ground level, this is a ground edge
-                    if abs(z1 - min_z) < tolerance and abs(z2 - min_z) < tolerance:
-                        # Create 2D line segment
-                        seg_2d = LineString([(p1[0], p1[1]), (p2[0], p2[1])])
-                        if seg_2d.length > 1e-10:  # Ignore zero-length segments
-                            ground_segments.append(seg_2d)
+        ground_segments = list(shapely.linestrings(edges_2d)) if len(edges_2d) else []
         
-        print(f"    Found {len(ground_segments)} ground-level segments")
+        if VERBOSE:
+            print(f"    Found {len(ground_segments)} ground-level segments")
         
         if not ground_segments:
-            print(f"    ⚠️  No ground segments found, trying alternative method...")
-            # Alternative: get all unique 2D points at ground level
-            ground_points = set()
-            for p in all_points_3d:
-                if abs(p[2] - min_z) < tolerance:
-                    ground_points.add((p[0], p[1]))
-            
-            if len(ground_points) >= 3:
-                # Create convex hull of ground points
-                from shapely.geometry import MultiPoint
-                mp = MultiPoint(list(ground_points))
-                polygon = mp.convex_hull
-                print(f"    Created convex hull from {len(ground_points)} ground points")
-                return polygon if polygon.is_valid else None
+            if VERBOSE:
+                print(f"    ⚠️  No ground segments found, trying alternative method...")
+            # Alternative: convex hull of all unique 2D points at ground level
+            ground_points = np.unique(coords[np.abs(z_values - min_z) < tolerance, :2], axis=0)
+            ring = _convex_hull_ring(ground_points)
+            if ring is not None:
+                if VERBOSE:
+                    print(f"    Created convex hull from {len(ground_points)} ground points")
+                return [ring]
             return None
         
         # Try to create polygon from ground segments
@@ -134,55 +190,65 @@ def extract_2d_footprint_from_3d_multilinestring(geom):
                     # Multiple polygons, take the largest one (main building footprint)
                     polygon = max(polygons, key=lambda p: p.area)
                 
-                print(f"    ✓ Created polygon with {len(polygon.exterior.coords)} vertices")
+                if VERBOSE:
+                    print(f"    ✓ Created polygon with {len(polygon.exterior.coords)} vertices")
                 
                 # Validate
                 if not polygon.is_valid:
                     polygon = polygon.buffer(0)
                 
                 if polygon.is_valid and not polygon.is_empty and polygon.area > 1e-10:
-                    return polygon
+                    return _polygon_rings(polygon)
         
         except Exception as e:
-            print(f"    Polygonize failed: {e}")
+            if VERBOSE:
+                print(f"    Polygonize failed: {e}")
         
         # Method 2: Collect unique points and create convex hull
-        print(f"    Trying convex hull method...")
-        unique_2d_points = set()
-        for seg in ground_segments:
-            for coord in seg.coords:
-                unique_2d_points.add((coord[0], coord[1]))
+        if VERBOSE:
+            print(f"    Trying convex hull method...")
+        # Reuse the ground edge array rather than re-reading each segment's coords
+        ring = _convex_hull_ring(np.unique(edges_2d.reshape(-1, 2), axis=0))
         
-        if len(unique_2d_points) >= 3:
-            from shapely.geometry import MultiPoint
-            mp = MultiPoint(list(unique_2d_points))
-            polygon = mp.convex_hull
-            
-            if polygon.geom_type == 'Polygon' and polygon.is_valid and not polygon.is_empty:
+        if ring is not None:
+            if VERBOSE:
                 print(f"    ✓ Created convex hull polygon")
-                return polygon
+            return [ring]
         
-        print(f"    ✗ Could not create valid polygon")
+        if VERBOSE:
+            print(f"    ✗ Could not create valid polygon")
         return None
         
     except Exception as e:
-        print(f"    ✗ Error: {e}")
+        if VERBOSE:
+            print(f"    ✗ Error: {e}")
         return None
 
-print("\n" + "="*60)
-print("EXTRACTING 2D FOOTPRINTS FROM 3D BUILDING GEOMETRIES")
-print("="*60)
+if not use_cache:
+    print("\n" + "="*60)
+    print("EXTRACTING 2D FOOTPRINTS FROM 3D BUILDING GEOMETRIES")
+    print("="*60)
 
-# Apply conversion with progress
-converted_geometries = []
-for idx, geom in enumerate(gdf.geometry):
-    if idx < 5 or idx % 20 == 0:  # Print progress for first 5 and every 20th
-        print(f"\n  Building {idx + 1}/{len(gdf)}:")
-    
-    footprint = extract_2d_footprint_from_3d_multilinestring(geom)
-    converted_geometries.append(footprint)
+    # Apply conversion across all cores; buildings are independent of each other.
+    # joblib's verbose output replaces the per-building progress lines.
+    print(f"\n  Converting {len(gdf)} buildings...")
+    converted_rings = Parallel(n_jobs=-1, backend='loky', batch_size=64, verbose=5)(
+        delayed(extract_2d_footprint_from_3d_multilinestring)(geom) for geom in gdf.geometry
+    )
+
+    # Build all footprint polygons in two bulk calls: rings from the flattened
+    # coordinates, then polygons from the rings (first ring per building is the shell)
+    has_footprint = np.array([rings is not None for rings in converted_rings], dtype=bool)
+    footprint_rings = [rings for rings in converted_rings if rings is not None]
+    converted_geometries = np.full(len(gdf), None, dtype=object)
+    if footprint_rings:
+        flat_rings = [ring for rings in footprint_rings for ring in rings]
+        ring_index = np.repeat(np.arange(len(flat_rings)), [len(ring) for ring in flat_rings])
+        polygon_index = np.repeat(np.arange(len(footprint_rings)), [len(rings) for rings in footprint_rings])
+        linear_rings = shapely.linearrings(np.concatenate(flat_rings), indices=ring_index)
+        converted_geometries[has_footprint] = shapely.polygons(linear_rings, indices=polygon_index)
 
-gdf['geometry'] = converted_geometries
+    gdf['geometry'] = gpd.GeoSeries(converted_geometries, index=gdf.index, crs=gdf.crs)
 
 # Remove any None geometries
 initial_count = len(gdf)
@@ -197,6 +263,8 @@ if final_count < initial_count:
 
 if len(gdf) > 0:
     print(f"New geometry types: {gdf.geometry.geom_type.value_counts().to_dict()}")
+    n_vertices = shapely.get_num_coordinates(gdf.geometry.to_numpy())
+    print(f"Footprint vertices: {n_vertices.sum()} total, {n_vertices.mean():.1f} per building")
     
     # Check if all are now Polygons
     if all(gdf.geometry.geom_type.isin(['Polygon', 'MultiPolygon'])):
@@ -207,37 +275,52 @@ else:
     print("\n❌ ERROR: No valid geometries after conversion!")
     exit(1)
 
+if not use_cache:
+    # Best effort: the input may sit in a read-only directory
+    try:
+        gdf.to_parquet(cache_path)
+        with open(cache_meta, 'w') as f:
+            f.write(input_mtime)
+    except OSError as e:
+        print(f"⚠️  Could not write footprint cache {cache_path} ({e}); continuing without it")
+
+# Simplify footprints (Ramer-Douglas-Peucker) to shrink the HTML and GeoJSON output.
+# Done in the metric source CRS when available, otherwise in degrees (~0.1 m).
+SIMPLIFY_TOLERANCE_M = 0.3
+SIMPLIFY_TOLERANCE_DEG = 1e-6
+simplify_tolerance = SIMPLIFY_TOLERANCE_M if gdf.crs and gdf.crs.is_projected else SIMPLIFY_TOLERANCE_DEG
+gdf['geometry'] = gdf.geometry.simplify(simplify_tolerance, preserve_topology=True)
+
 # Convert to WGS84 if needed
 if gdf.crs and gdf.crs != "EPSG:4326":
     print(f"Converting from {gdf.crs} to EPSG:4326...")
     gdf = gdf.to_crs("EPSG:4326")
 
 # Calculate risk metrics
-gdf['risk_percentile'] = gdf['expected_deaths_mean'].rank(pct=True) * 100
-gdf['cv'] = gdf['expected_deaths_std'] / (gdf['expected_deaths_mean'] + 1e-10)
-
-# Assign risk categories
-def assign_risk_category(percentile):
-    if percentile >= 95:
-        return "Very High (Top 5%)", "#8B0000"
-    elif percentile >= 90:
-        return "High (90-95%)", "#DC143C"
-    elif percentile >= 75:
-        return "Elevated (75-90%)", "#FF8C00"
-    elif percentile >= 50:
-        return "Moderate (50-75%)", "#FFD700"
-    elif percentile >= 25:
-        return "Low-Moderate (25-50%)", "#9ACD32"
-    else:
-        return "Low (Bottom 25%)", "#228B22"
+gdf['risk_percentile'] = pct_rank(gdf['expected_deaths_mean'].to_numpy())
+mean = gdf['expected_deaths_mean'].to_numpy()
+std = gdf['expected_deaths_std'].to_numpy()
+with np.errstate(divide='ignore', invalid='ignore'):
+    gdf['cv'] = np.where(mean > 0, std / mean, np.nan)
 
-gdf[['risk_category', 'category_color']] = gdf['risk_percentile'].apply(
-    lambda x: pd.Series(assign_risk_category(x))
-)
+# Assign risk categories; buildings without a percentile are marked as having no data
+category_idx = category_codes(gdf['risk_percentile'].to_numpy())
+no_data = category_idx < 0
+gdf['risk_category'] = NO_DATA_CATEGORY
+gdf['category_color'] = NO_DATA_COLOR
+gdf.loc[~no_data, 'risk_category'] = CATEGORY_NAMES[category_idx[~no_data]]
+gdf.loc[~no_data, 'category_color'] = CATEGORY_COLORS[category_idx[~no_data]]
+
+# Save converted data
+output_geojson = "../Output/Data/buildings_with_risk_2D_FINAL.geojson"
+gdf.to_file(output_geojson, driver='GeoJSON', engine='pyogrio')
+print(f"\n✅ 2D footprint data saved to: {output_geojson}")
 
 # Create map
-center_lat = gdf.geometry.centroid.y.mean()
-center_lon = gdf.geometry.centroid.x.mean()
+# Center on the bounding box of all buildings (one bulk bounds call)
+minx, miny, maxx, maxy = gdf.total_bounds
+center_lat = (miny + maxy) / 2
+center_lon = (minx + maxx) / 2
 
 print("\n" + "="*60)
 print("CREATING INTERACTIVE MAP")
@@ -252,13 +335,12 @@ m = folium.Map(
 folium.TileLayer('OpenStreetMap', name='OpenStreetMap').add_to(m)
 folium.TileLayer('CartoDB dark_matter', name='CartoDB Dark').add_to(m)
 
-# Add buildings
-for idx, row in gdf.iterrows():
-    popup_html = f"""
+# Popup HTML template with named fields; numeric fields are pre-formatted in NumPy
+POPUP_TEMPLATE = """
     <div style="width: 320px; font-family: Arial, sans-serif;">
-        <h3 style="margin: 0 0 10px 0; padding: 8px; background-color: {row['category_color']}; 
+        <h3 style="margin: 0 0 10px 0; padding: 8px; background-color: {color}; 
                    color: white; text-align: center;">
-            {row['risk_category']}
+            {category}
         </h3>
         <table style="width: 100%; font-size: 12px; border-collapse: collapse;">
             <tr style="background-color: #f0f0f0;">
@@ -266,20 +348,20 @@ for idx, row in gdf.iterrows():
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Expected Deaths (Mean):</b></td>
-                <td style="text-align: right; padding: 5px;">{row['expected_deaths_mean']:.4e}</td>
+                <td style="text-align: right; padding: 5px;">{mean}</td>
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Expected Deaths (Std):</b></td>
-                <td style="text-align: right; padding: 5px;">{row['expected_deaths_std']:.4e}</td>
+                <td style="text-align: right; padding: 5px;">{std}</td>
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Coefficient of Variation:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['cv']:.3f}</td>
+                <td style="text-align: right; padding: 5px;">{cv}</td>
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Risk Percentile:</b></td>
-                <td style="text-align: right; padding: 5px; font-weight: bold; color: {row['category_color']};">
-                    {row['risk_percentile']:.1f}%
+                <td style="text-align: right; padding: 5px; font-weight: bold; color: {color};">
+                    {percentile}%
                 </td>
             </tr>
             <tr style="background-color: #f0f0f0;">
@@ -287,42 +369,85 @@ for idx, row in gdf.iterrows():
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Occupants:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['num_occupants']:.0f}</td>
+                <td style="text-align: right; padding: 5px;">{occupants}</td>
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Height:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['citygml_measured_height']:.2f} {row['citygml_measured_height_units']}</td>
+                <td style="text-align: right; padding: 5px;">{height} {height_units}</td>
             </tr>
             <tr>
                 <td style="padding: 5px;"><b>Storeys:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['citygml_storeys_above_ground']}</td>
+                <td style="text-align: right; padding: 5px;">{storeys}</td>
             </tr>
         </table>
     </div>
     """
-    
-    geojson = folium.GeoJson(
-        data=row['geometry'].__geo_interface__,
-        style_function=lambda x, color=row['category_color']: {
-            'fillColor': color,
-            'color': color,
+
+# Above this many buildings, Leaflet SVG rendering stalls; serve vector tiles instead
+use_vector_tiles = len(gdf) > VECTOR_TILE_THRESHOLD
+if use_vector_tiles and not vector_tiles_available():
+    print(f"⚠️  {len(gdf)} buildings but mapbox_vector_tile not installed, falling back to a GeoJSON layer")
+    use_vector_tiles = False
+
+if use_vector_tiles:
+    # Pre-bake a .pbf tile pyramid next to the HTML map; the browser then only
+    # decodes tiles in view. Popups are only available on the GeoJSON path.
+    tiles_dir = "../Output/Maps/building_risk_tiles"
+    n_tiles = write_vector_tiles(gdf, tiles_dir, ['category_color', 'risk_category', 'expected_deaths_mean'])
+    print(f"Wrote {n_tiles} vector tiles to: {tiles_dir} (open the map through a local web server)")
+    add_vector_tile_layer(m, "building_risk_tiles/{z}/{x}/{y}.pbf", 'category_color', weight=1)
+else:
+    popup_columns = {
+        'color': gdf['category_color'].to_numpy(),
+        'category': gdf['risk_category'].to_numpy(),
+        'mean': np.char.mod('%.4e', gdf['expected_deaths_mean'].to_numpy()),
+        'std': np.char.mod('%.4e', gdf['expected_deaths_std'].to_numpy()),
+        'cv': np.char.mod('%.3f', gdf['cv'].to_numpy()),
+        'percentile': np.char.mod('%.1f', gdf['risk_percentile'].to_numpy()),
+        'occupants': np.char.mod('%.0f', gdf['num_occupants'].to_numpy()),
+        'height': np.char.mod('%.2f', gdf['citygml_measured_height'].to_numpy()),
+        'height_units': gdf['citygml_measured_height_units'].astype(str).to_numpy(),
+        'storeys': gdf['citygml_storeys_above_ground'].astype(str).to_numpy()
+    }
+    gdf['popup_html'] = [
+        POPUP_TEMPLATE.format_map(dict(zip(popup_columns, values)))
+        for values in zip(*popup_columns.values())
+    ]
+
+    gdf['risk_text'] = np.char.mod('%.3e', gdf['expected_deaths_mean'].to_numpy())
+
+    # Add buildings as one GeoJSON layer; style and popups are read from feature properties
+    features = orjson.loads(gdf[[
+        'popup_html', 'risk_category', 'risk_text', 'category_color', 'geometry'
+    ]].to_json())
+
+    folium.GeoJson(
+        features,
+        name='Buildings',
+        style_function=lambda feature: {
+            'fillColor': feature['properties']['category_color'],
+            'color': feature['properties']['category_color'],
             'weight': 1,
             'fillOpacity': 0.85,
             'opacity': 1.0
         },
-        highlight_function=lambda x, color=row['category_color']: {
-            'fillColor': color,
+        highlight_function=lambda feature: {
+            'fillColor': feature['properties']['category_color'],
             'color': 'white',
             'weight': 2.5,
             'fillOpacity': 1.0
         },
-        tooltip=folium.Tooltip(
-            f"<b>{row['risk_category']}</b><br>Risk: {row['expected_deaths_mean']:.3e}",
+        tooltip=folium.GeoJsonTooltip(
+            fields=['risk_category', 'risk_text'],
+            aliases=['', 'Risk:'],
             sticky=False
         ),
-        popup=folium.Popup(popup_html, max_width=350)
-    )
-    geojson.add_to(m)
+        popup=folium.GeoJsonPopup(
+            fields=['popup_html'],
+            labels=False,
+            max_width=350
+        )
+    ).add_to(m)
 
 # Statistics
 vmin = gdf['expected_deaths_mean'].min()
@@ -395,22 +520,12 @@ print(f"Map saved to: {output_path}")
 print(f"Buildings: {len(gdf)}")
 print(f"Risk range: {vmin:.4e} to {vmax:.4e}")
 
-# Save converted data
-output_geojson = "../Output/Data/buildings_with_risk_2D_FINAL.geojson"
-gdf.to_file(output_geojson, driver='GeoJSON')
-print(f"\n✅ 2D footprint data saved to: {output_geojson}")
-
 # Print category stats
 print(f"\n{'='*60}")
 print("RISK CATEGORY DISTRIBUTION")
 print(f"{'='*60}")
-for name, low, high in [
-    ("Very High (Top 5%)", 95, 100),
-    ("High (90-95%)", 90, 95),
-    ("Elevated (75-90%)", 75, 90),
-    ("Moderate (50-75%)", 50, 75),
-    ("Low-Moderate (25-50%)", 25, 50),
-    ("Low (Bottom 25%)", 0, 25)
-]:
-    subset = gdf[(gdf['risk_percentile'] >= low) & (gdf['risk_percentile'] < high)]
-    print(f"{name}: {len(subset)} buildings ({len(subset)/len(gdf)*100:.1f}%)")
+# Reuse the category codes from the risk classification instead of re-filtering;
+# buildings without data (code -1) are not counted in any category
+category_counts = np.bincount(category_idx[~no_data], minlength=len(CATEGORY_NAMES))
+for name, count in zip(CATEGORY_NAMES[::-1], category_counts[::-1]):
+    print(f"{name}: {count} buildings ({count/len(gdf)*100:.1f}%)")
@@ -0,0 +1,27 @@
+"""Shared loading of the building GeoJSON files used by the mapping scripts."""
+import os
+
+import geopandas as gpd
+
+
+def load_buildings(path):
+    """
+    Load a buildings GeoJSON reprojected to WGS84 (EPSG:4326).
+    
+    The reprojected data is cached as GeoParquet next to the input and reused
+    while it is newer than the GeoJSON, so later runs skip the JSON parse and
+    the reprojection. If the cache cannot be written (e.g. a read-only input
+    directory) the data is still returned, just without caching.
+    """
+    parquet_path = path + '.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        return gpd.read_parquet(parquet_path)
+    
+    gdf = gpd.read_file(path, engine='pyogrio')
+    if gdf.crs != "EPSG:4326":
+        gdf = gdf.to_crs("EPSG:4326")
+    try:
+        gdf.to_parquet(parquet_path)
+    except OSError as e:
+        print(f"Could not write cache {parquet_path} ({e}); continuing without it")
+    return gdf
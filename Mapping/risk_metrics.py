@@ -0,0 +1,38 @@
+"""Percentile ranking and risk categories shared by the mapping scripts."""
+import numpy as np
+
+# Risk categories from lowest to highest, split at these percentile edges
+RISK_BIN_EDGES = np.array([25, 50, 75, 90, 95])
+CATEGORY_NAMES = np.array([
+    "Low (Bottom 25%)",
+    "Low-Moderate (25-50%)",
+    "Moderate (50-75%)",
+    "Elevated (75-90%)",
+    "High (90-95%)",
+    "Very High (Top 5%)"
+])
+CATEGORY_COLORS = np.array(["#228B22", "#9ACD32", "#FFD700", "#FF8C00", "#DC143C", "#8B0000"])
+
+# Buildings without a risk value have no percentile and are kept out of the ranking
+NO_DATA_CATEGORY = "No data"
+NO_DATA_COLOR = "#808080"
+
+
+def pct_rank(values):
+    """Percentile rank (0-100] with tied values averaged, like rank(pct=True); NaN stays NaN"""
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    # One sort of the valid values; each group of equal values gets the mean of the
+    # ordinal ranks it spans, so identical risks always land in the same category
+    _, inverse, counts = np.unique(values[valid], return_inverse=True, return_counts=True)
+    mean_ranks = np.cumsum(counts) - (counts - 1) / 2
+    pct = np.full(len(values), np.nan)
+    pct[valid] = mean_ranks[inverse] / valid.sum() * 100
+    return pct
+
+def category_codes(percentiles):
+    """Index into CATEGORY_NAMES for each percentile, or -1 where it is missing"""
+    percentiles = np.asarray(percentiles, dtype=float)
+    codes = np.searchsorted(RISK_BIN_EDGES, percentiles, side='right')
+    codes[np.isnan(percentiles)] = -1
+    return codes
@@ -0,0 +1,82 @@
+"""Mapbox Vector Tile output for building maps that are too large for one GeoJSON layer."""
+import importlib.util
+import os
+import shutil
+
+import shapely
+from folium import plugins
+
+# Above this many buildings, one Leaflet layer with every polygon stalls the browser;
+# precompute vector tiles per zoom level so only tiles in view are decoded
+VECTOR_TILE_THRESHOLD = 2000
+TILE_MIN_ZOOM, TILE_MAX_ZOOM = 12, 18
+
+
+def vector_tiles_available():
+    """Whether the optional mapbox_vector_tile encoder is installed"""
+    return importlib.util.find_spec('mapbox_vector_tile') is not None
+
+def write_vector_tiles(gdf, tiles_dir, columns, min_zoom=TILE_MIN_ZOOM, max_zoom=TILE_MAX_ZOOM,
+                       layer_name='buildings'):
+    """Replace tiles_dir with a {z}/{x}/{y}.pbf tile pyramid of gdf polygons and columns"""
+    import mapbox_vector_tile
+    from shapely.geometry import box
+    
+    shutil.rmtree(tiles_dir, ignore_errors=True)
+    world = 20037508.342789244  # Web Mercator half-extent in meters
+    merc = gdf[columns + ['geometry']].to_crs("EPSG:3857")
+    records = merc[columns].to_dict('records')
+    geoms = merc.geometry.to_numpy()
+    minx, miny, maxx, maxy = merc.total_bounds
+    
+    n_tiles = 0
+    for z in range(min_zoom, max_zoom + 1):
+        size = 2 * world / 2 ** z
+        for x in range(int((minx + world) // size), int((maxx + world) // size) + 1):
+            for y in range(int((world - maxy) // size), int((world - miny) // size) + 1):
+                bounds = (x * size - world, world - (y + 1) * size,
+                          (x + 1) * size - world, world - y * size)
+                hits = merc.sindex.query(box(*bounds))
+                if len(hits) == 0:
+                    continue
+                clipped = shapely.clip_by_rect(geoms[hits], *bounds)
+                features = [
+                    {'geometry': geom, 'properties': records[i]}
+                    for i, geom in zip(hits, clipped) if not geom.is_empty
+                ]
+                if not features:
+                    continue
+                tile = mapbox_vector_tile.encode(
+                    [{'name': layer_name, 'features': features}],
+                    default_options={'quantize_bounds': bounds, 'extents': 4096}
+                )
+                tile_path = os.path.join(tiles_dir, str(z), str(x), f"{y}.pbf")
+                os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+                with open(tile_path, 'wb') as f:
+                    f.write(tile)
+                n_tiles += 1
+    return n_tiles
+
+def add_vector_tile_layer(m, tiles_url, color_property, weight=0.5, min_zoom=TILE_MIN_ZOOM,
+                          max_zoom=TILE_MAX_ZOOM, layer_name='buildings'):
+    """Add tiles written by write_vector_tiles to m, filled from the color_property field"""
+    plugins.VectorGridProtobuf(
+        tiles_url,
+        "Buildings",
+        """{
+            "minNativeZoom": %d,
+            "maxNativeZoom": %d,
+            "vectorTileLayerStyles": {
+                "%s": function(properties, zoom) {
+                    return {
+                        fill: true,
+                        fillColor: properties.%s,
+                        color: properties.%s,
+                        weight: %s,
+                        fillOpacity: 0.85,
+                        opacity: 1.0
+                    };
+                }
+            }
+        }""" % (min_zoom, max_zoom, layer_name, color_property, color_property, weight)
+    ).add_to(m)
@@ -2,13 +2,13 @@ import geopandas as gpd
 import folium
 from folium import plugins
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
+from matplotlib import colormaps
 
 # Read the GeoJSON file - adjust this path as needed
 # Try multiple possible paths
 import os
-import pandas as pd
+import orjson
 
 possible_paths = [
     "buildings_with_risk_data.geojson",
@@ -20,7 +20,7 @@ gdf = None
 for path in possible_paths:
     if os.path.exists(path):
         print(f"Found file at: {path}")
-        gdf = gpd.read_file(path)
+        gdf = gpd.read_file(path, engine='pyogrio')
         break
 
 if gdf is None:
@@ -32,9 +32,10 @@ if gdf is None:
 if gdf.crs != "EPSG:4326":
     gdf = gdf.to_crs("EPSG:4326")
 
-# Get the center of the map
-center_lat = gdf.geometry.centroid.y.mean()
-center_lon = gdf.geometry.centroid.x.mean()
+# Get the center of the map from the bounding box of all buildings (one bulk bounds call)
+minx, miny, maxx, maxy = gdf.total_bounds
+center_lat = (miny + maxy) / 2
+center_lon = (minx + maxx) / 2
 
 # Create a base map
 m = folium.Map(
@@ -67,79 +68,79 @@ else:
     vmax_plot = vmax
 
 # Create a colormap (red for high risk, yellow for medium, green for low)
-colormap = plt.cm.get_cmap('YlOrRd')
+colormap = colormaps['YlOrRd']
 
-def get_color(value, vmin, vmax, use_log=False):
-    """Convert value to color using colormap"""
-    if pd.isna(value):
-        return '#808080'  # Gray for missing values
+def get_colors(values, vmin, vmax, use_log=False):
+    """Convert an array of values to hex colors using the colormap in one pass"""
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
     
     if use_log:
         # Use log scale
-        value_transformed = np.log10(value + 1e-10)
+        values_transformed = np.log10(values + 1e-10)
     else:
-        value_transformed = value
+        values_transformed = values
     
-    normalized = (value_transformed - vmin) / (vmax - vmin) if vmax > vmin else 0
-    normalized = np.clip(normalized, 0, 1)  # Ensure in [0, 1]
+    if vmax > vmin:
+        normalized = (values_transformed - vmin) / (vmax - vmin)
+    else:
+        normalized = np.zeros_like(values_transformed)
+    normalized = np.clip(np.nan_to_num(normalized), 0, 1)  # Ensure in [0, 1]
     rgba = colormap(normalized)
-    return mcolors.rgb2hex(rgba)
+    colors = np.array([mcolors.rgb2hex(c) for c in rgba])
+    colors[missing] = '#808080'  # Gray for missing values
+    return colors
+
+# Precompute per-building color and CV so the whole layer can be added at once
+gdf['color'] = get_colors(gdf['expected_deaths_mean'].to_numpy(), vmin_plot, vmax_plot, use_log_scale)
+mean = gdf['expected_deaths_mean'].to_numpy()
+std = gdf['expected_deaths_std'].to_numpy()
+with np.errstate(divide='ignore', invalid='ignore'):
+    cv = np.where(mean > 0, std / mean, np.nan)
+
+# Popup/tooltip values are shown verbatim, so format them here (scientific notation
+# for the small risk values)
+gdf['mean_text'] = np.char.mod('%.4e', mean)
+gdf['std_text'] = np.char.mod('%.4e', std)
+gdf['cv_text'] = np.char.mod('%.3f', cv)
+gdf['risk_text'] = np.char.mod('%.3e', mean)
+gdf['occupants_text'] = np.char.mod('%.0f', gdf['num_occupants'].to_numpy())
+gdf['height_text'] = np.char.add(
+    np.char.mod('%.2f ', gdf['citygml_measured_height'].to_numpy()),
+    gdf['citygml_measured_height_units'].astype(str).to_numpy()
+)
 
-# Add buildings to the map
-for idx, row in gdf.iterrows():
-    # Get color based on expected deaths mean
-    color = get_color(row['expected_deaths_mean'], vmin_plot, vmax_plot, use_log_scale)
-    
-    # Create popup with risk information (using scientific notation for small values)
-    popup_html = f"""
-    <div style="width: 280px;">
-        <h4 style="margin-bottom: 10px;">Building Risk Information</h4>
-        <table style="width: 100%; font-size: 12px;">
-            <tr>
-                <td><b>Expected Deaths (Mean):</b></td>
-                <td style="text-align: right;">{row['expected_deaths_mean']:.4e}</td>
-            </tr>
-            <tr>
-                <td><b>Expected Deaths (Std):</b></td>
-                <td style="text-align: right;">{row['expected_deaths_std']:.4e}</td>
-            </tr>
-            <tr>
-                <td><b>Coefficient of Variation:</b></td>
-                <td style="text-align: right;">{row['expected_deaths_std']/row['expected_deaths_mean']:.3f}</td>
-            </tr>
-            <tr style="border-top: 1px solid #ccc;">
-                <td><b>Number of Occupants:</b></td>
-                <td style="text-align: right;">{row['num_occupants']:.0f}</td>
-            </tr>
-            <tr>
-                <td><b>Building Height:</b></td>
-                <td style="text-align: right;">{row['citygml_measured_height']:.2f} {row['citygml_measured_height_units']}</td>
-            </tr>
-            <tr>
-                <td><b>Storeys:</b></td>
-                <td style="text-align: right;">{row['citygml_storeys_above_ground']}</td>
-            </tr>
-            <tr>
-                <td><b>Roof Type:</b></td>
-                <td style="text-align: right;">{row['citygml_roof_type']}</td>
-            </tr>
-        </table>
-    </div>
-    """
-    
-    # Add the building polygon as a filled block
-    folium.GeoJson(
-        row['geometry'],
-        style_function=lambda x, color=color: {
-            'fillColor': color,
-            'color': color,  # Border color matches fill for solid appearance
-            'weight': 0.5,
-            'fillOpacity': 0.85,
-            'opacity': 1.0
-        },
-        popup=folium.Popup(popup_html, max_width=300),
-        tooltip=f"Risk: {row['expected_deaths_mean']:.3e}"
-    ).add_to(m)
+popup_fields = [
+    'mean_text', 'std_text', 'cv_text', 'occupants_text', 'height_text',
+    'citygml_storeys_above_ground', 'citygml_roof_type'
+]
+popup_aliases = [
+    'Expected Deaths (Mean):', 'Expected Deaths (Std):', 'Coefficient of Variation:',
+    'Number of Occupants:', 'Building Height:', 'Storeys:', 'Roof Type:'
+]
+features = orjson.loads(gdf[popup_fields + ['risk_text', 'color', 'geometry']].to_json())
+
+# Add the buildings as filled blocks in a single GeoJSON layer
+folium.GeoJson(
+    features,
+    name='Buildings',
+    style_function=lambda feature: {
+        'fillColor': feature['properties']['color'],
+        'color': feature['properties']['color'],  # Border color matches fill for solid appearance
+        'weight': 0.5,
+        'fillOpacity': 0.85,
+        'opacity': 1.0
+    },
+    popup=folium.GeoJsonPopup(
+        fields=popup_fields,
+        aliases=popup_aliases,
+        max_width=300
+    ),
+    tooltip=folium.GeoJsonTooltip(
+        fields=['risk_text'],
+        aliases=['Risk:']
+    )
+).add_to(m)
 
 # Add a custom legend with scientific notation
 scale_text = " (Log Scale)" if use_log_scale else ""
@@ -193,5 +194,5 @@ print(f"Total occupants: {gdf['num_occupants'].sum():.0f}")
 # Show top 5 highest risk buildings
 print("\n=== Top 5 Highest Risk Buildings ===")
 top_5 = gdf.nlargest(5, 'expected_deaths_mean')[['expected_deaths_mean', 'expected_deaths_std', 'num_occupants']]
-for idx, (i, row) in enumerate(top_5.iterrows(), 1):
-    print(f"{idx}. Mean: {row['expected_deaths_mean']:.4e}, Std: {row['expected_deaths_std']:.4e}, Occupants: {row['num_occupants']:.0f}")
+for idx, row in enumerate(top_5.itertuples(index=False), 1):
+    print(f"{idx}. Mean: {row.expected_deaths_mean:.4e}, Std: {row.expected_deaths_std:.4e}, Occupants: {row.num_occupants:.0f}")
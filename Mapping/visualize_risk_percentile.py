@@ -1,11 +1,21 @@
-import geopandas as gpd
 import folium
 from folium import plugins
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+from matplotlib import colormaps
 import pandas as pd
 import os
+import sys
+import gzip
+import shutil
+import hashlib
+from buildings_io import load_buildings
+from vector_tiles import (
+    VECTOR_TILE_THRESHOLD, vector_tiles_available, write_vector_tiles, add_vector_tile_layer
+)
+from risk_metrics import pct_rank, category_codes, CATEGORY_NAMES, NO_DATA_CATEGORY, NO_DATA_COLOR
+
+# Use percentile-based coloring for better discrimination
+CMAP = colormaps['RdYlGn_r']  # Red for high risk, green for low
 
 # Read the GeoJSON file - UPDATE THIS PATH
 possible_paths = [
@@ -14,28 +24,62 @@ possible_paths = [
     "../Output/Data/residential_buildings_only.geojson"
 ]
 
-gdf = None
+input_path = None
 for path in possible_paths:
     if os.path.exists(path):
         print(f"Found file at: {path}")
-        gdf = gpd.read_file(path)
+        input_path = path
         break
 
-if gdf is None:
+if input_path is None:
     print("ERROR: Could not find the GeoJSON file. Please update the path in the script.")
     print("Searched paths:", possible_paths)
     exit(1)
 
-# Convert to WGS84 (EPSG:4326) for web mapping if not already
-if gdf.crs != "EPSG:4326":
-    gdf = gdf.to_crs("EPSG:4326")
+output_path = "../Output/Maps/building_risk_percentile_map.html"
+
+# Skip regeneration when neither the input data nor the code (this script and the
+# shared modules it imports) changed since the map was last saved; the key is a hash
+# of all of them, stored next to the HTML. Files are hashed in chunks so a cache hit
+# never holds the whole GeoJSON in memory
+script_dir = os.path.dirname(os.path.abspath(__file__))
+hasher = hashlib.blake2b(digest_size=8)
+shared_modules = ['buildings_io.py', 'risk_metrics.py', 'vector_tiles.py']
+for source in [input_path, __file__] + [os.path.join(script_dir, name) for name in shared_modules]:
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+cache_key = hasher.hexdigest()
+key_path = output_path + '.key'
+if os.path.exists(output_path) and os.path.exists(key_path):
+    with open(key_path) as f:
+        if f.read() == cache_key:
+            print(f"Map is up to date (cached, skipping): {output_path}")
+            sys.exit(0)
+
+gdf = load_buildings(input_path)  # Already in WGS84 (EPSG:4326) for web mapping
+
+# Keep only the fields the map uses; everything else would be carried through
+# every step and serialized into the HTML
+keep_columns = [
+    'expected_deaths_mean', 'expected_deaths_std', 'num_occupants',
+    'citygml_measured_height', 'citygml_measured_height_units',
+    'citygml_storeys_above_ground', 'citygml_roof_type', 'geometry'
+]
+gdf = gdf[keep_columns].copy()
+
+# Simplify footprints (Ramer-Douglas-Peucker) before rendering; vertex count drives
+# both the HTML size and Leaflet draw time. ~1 m at this latitude range
+SIMPLIFY_TOLERANCE_DEG = 1e-5
+gdf['geometry'] = gdf.geometry.simplify(SIMPLIFY_TOLERANCE_DEG, preserve_topology=True)
 
 # Calculate percentile ranks for better visualization of small values
-gdf['risk_percentile'] = gdf['expected_deaths_mean'].rank(pct=True) * 100
+gdf['risk_percentile'] = pct_rank(gdf['expected_deaths_mean'].to_numpy())
 
-# Get the center of the map
-center_lat = gdf.geometry.centroid.y.mean()
-center_lon = gdf.geometry.centroid.x.mean()
+# Get the center of the map from the bounding box of all buildings (one bulk bounds call)
+minx, miny, maxx, maxy = gdf.total_bounds
+center_lat = (miny + maxy) / 2
+center_lon = (minx + maxx) / 2
 
 # Create a base map
 m = folium.Map(
@@ -48,26 +92,10 @@ m = folium.Map(
 folium.TileLayer('OpenStreetMap', name='OpenStreetMap').add_to(m)
 folium.TileLayer('CartoDB dark_matter', name='CartoDB Dark').add_to(m)
 
-# Use percentile-based coloring for better discrimination
-colormap = plt.cm.get_cmap('RdYlGn_r')  # Red for high risk, green for low
-
-def get_color_from_percentile(percentile):
-    """Convert percentile (0-100) to color"""
-    if pd.isna(percentile):
-        return '#808080'  # Gray for missing values
-    
-    normalized = percentile / 100.0
-    rgba = colormap(normalized)
-    return mcolors.rgb2hex(rgba)
-
-# Statistics
-vmin = gdf['expected_deaths_mean'].min()
-vmax = gdf['expected_deaths_mean'].max()
-median = gdf['expected_deaths_mean'].median()
-p25 = gdf['expected_deaths_mean'].quantile(0.25)
-p75 = gdf['expected_deaths_mean'].quantile(0.75)
-p90 = gdf['expected_deaths_mean'].quantile(0.90)
-p95 = gdf['expected_deaths_mean'].quantile(0.95)
+# Statistics (all quantiles from a single pass over the column)
+vmin, p25, median, p75, p90, p95, vmax = np.nanquantile(
+    gdf['expected_deaths_mean'].to_numpy(), [0.0, 0.25, 0.5, 0.75, 0.90, 0.95, 1.0]
+)
 
 print("\n" + "="*60)
 print("RISK VALUE DISTRIBUTION")
@@ -82,99 +110,101 @@ print(f"  90th pct: {p90:.4e}")
 print(f"  95th pct: {p95:.4e}")
 print(f"  Maximum:  {vmax:.4e}")
 
-# Add buildings to the map with percentile-based coloring
-for idx, row in gdf.iterrows():
-    # Get color based on percentile
-    color = get_color_from_percentile(row['risk_percentile'])
-    
-    # Calculate coefficient of variation
-    cv = row['expected_deaths_std'] / row['expected_deaths_mean'] if row['expected_deaths_mean'] > 0 else np.nan
-    
-    # Determine risk category based on percentiles
-    if row['risk_percentile'] >= 95:
-        risk_category = "Very High (Top 5%)"
-        category_color = "#8B0000"
-    elif row['risk_percentile'] >= 90:
-        risk_category = "High (Top 10%)"
-        category_color = "#DC143C"
-    elif row['risk_percentile'] >= 75:
-        risk_category = "Elevated (Top 25%)"
-        category_color = "#FF8C00"
-    elif row['risk_percentile'] >= 50:
-        risk_category = "Moderate"
-        category_color = "#FFD700"
-    elif row['risk_percentile'] >= 25:
-        risk_category = "Low-Moderate"
-        category_color = "#9ACD32"
-    else:
-        risk_category = "Low (Bottom 25%)"
-        category_color = "#228B22"
-    
-    # Create enhanced popup with risk information
-    popup_html = f"""
-    <div style="width: 320px; font-family: Arial, sans-serif;">
-        <h3 style="margin: 0 0 10px 0; padding: 8px; background-color: {category_color}; 
-                   color: white; text-align: center;">
-            {risk_category}
-        </h3>
-        <table style="width: 100%; font-size: 12px; border-collapse: collapse;">
-            <tr style="background-color: #f0f0f0;">
-                <td colspan="2" style="padding: 5px; font-weight: bold;">Risk Metrics</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Expected Deaths (Mean):</b></td>
-                <td style="text-align: right; padding: 5px;">{row['expected_deaths_mean']:.4e}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Expected Deaths (Std):</b></td>
-                <td style="text-align: right; padding: 5px;">{row['expected_deaths_std']:.4e}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Coefficient of Variation:</b></td>
-                <td style="text-align: right; padding: 5px;">{cv:.3f}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Risk Percentile:</b></td>
-                <td style="text-align: right; padding: 5px; font-weight: bold; color: {category_color};">
-                    {row['risk_percentile']:.1f}%
-                </td>
-            </tr>
-            <tr style="background-color: #f0f0f0;">
-                <td colspan="2" style="padding: 5px; font-weight: bold;">Building Information</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Number of Occupants:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['num_occupants']:.0f}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Building Height:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['citygml_measured_height']:.2f} {row['citygml_measured_height_units']}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Storeys:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['citygml_storeys_above_ground']}</td>
-            </tr>
-            <tr>
-                <td style="padding: 5px;"><b>Roof Type:</b></td>
-                <td style="text-align: right; padding: 5px;">{row['citygml_roof_type']}</td>
-            </tr>
-        </table>
-    </div>
-    """
+# Precompute per-building attributes as columns so the whole layer is added at once
+mean = gdf['expected_deaths_mean'].to_numpy()
+with np.errstate(divide='ignore', invalid='ignore'):
+    gdf['_cv'] = np.where(mean > 0, gdf['expected_deaths_std'].to_numpy() / mean, np.nan)
+# Colors for all percentiles (0-100) in one colormap call; gray for missing values
+pct = gdf['risk_percentile'].to_numpy() / 100.0
+missing = np.isnan(pct)
+rgb = np.round(CMAP(np.nan_to_num(pct))[:, :3] * 255).astype(np.uint8)
+fill = np.array(['#{:02x}{:02x}{:02x}'.format(*c) for c in rgb])
+fill[missing] = NO_DATA_COLOR
+gdf['_fill'] = fill
+
+# Determine risk category based on percentiles. Buildings without a percentile get
+# code -1, which pandas stores as a missing category rather than any of the labels
+gdf['_category'] = pd.Categorical.from_codes(
+    category_codes(gdf['risk_percentile'].to_numpy()), categories=CATEGORY_NAMES
+)
+
+def building_style(feature):
+    """Shared style for every building feature; the color comes from its _fill property"""
+    return {
+        'fillColor': feature['properties']['_fill'],
+        'color': feature['properties']['_fill'],  # Border color same as fill for solid block appearance
+        'weight': 0.5,   # Thin border
+        'fillOpacity': 0.85,  # More opaque for solid block appearance
+        'opacity': 1.0   # Solid border
+    }
+
+use_vector_tiles = len(gdf) > VECTOR_TILE_THRESHOLD
+if use_vector_tiles and not vector_tiles_available():
+    print(f"⚠️  {len(gdf)} buildings but mapbox_vector_tile not installed, falling back to GeoJSON layers")
+    use_vector_tiles = False
+
+if use_vector_tiles:
+    # Tiles live next to the HTML map; popups are only available on the GeoJSON path
+    tiles_dir = "../Output/Maps/building_risk_percentile_tiles"
+    n_tiles = write_vector_tiles(gdf, tiles_dir, ['_fill', 'risk_percentile', 'expected_deaths_mean'])
+    print(f"Wrote {n_tiles} vector tiles to: {tiles_dir} (open the map through a local web server)")
+    add_vector_tile_layer(m, "building_risk_percentile_tiles/{z}/{x}/{y}.pbf", '_fill')
+else:
+    # Popups are rendered client-side by one folium template from these properties,
+    # rather than shipping a pre-expanded HTML table per building. The template shows
+    # values verbatim, so numbers are formatted here (risks are ~1e-4 and need
+    # scientific notation)
+    gdf['_category_text'] = np.where(missing, NO_DATA_CATEGORY, gdf['_category'].astype(str))
+    gdf['_mean_text'] = np.char.mod('%.4e', gdf['expected_deaths_mean'].to_numpy())
+    gdf['_std_text'] = np.char.mod('%.4e', gdf['expected_deaths_std'].to_numpy())
+    gdf['_cv_text'] = np.char.mod('%.3f', gdf['_cv'].to_numpy())
+    gdf['_percentile_text'] = np.char.mod('%.1f%%', gdf['risk_percentile'].to_numpy())
+    gdf['_risk_text'] = np.char.mod('%.3e', gdf['expected_deaths_mean'].to_numpy())
+    gdf['_occupants_text'] = np.char.mod('%.0f', gdf['num_occupants'].to_numpy())
+    gdf['_height_text'] = np.char.add(
+        np.char.mod('%.2f ', gdf['citygml_measured_height'].to_numpy()),
+        gdf['citygml_measured_height_units'].astype(str).to_numpy()
+    )
+    popup_fields = [
+        '_category_text', '_mean_text', '_std_text', '_cv_text', '_percentile_text',
+        '_occupants_text', '_height_text', 'citygml_storeys_above_ground', 'citygml_roof_type'
+    ]
+    popup_aliases = [
+        'Risk Category', 'Expected Deaths (Mean)', 'Expected Deaths (Std)', 'CoV', 'Risk Percentile',
+        'Occupants', 'Height', 'Storeys', 'Roof'
+    ]
+    layer_columns = ['_fill', '_risk_text'] + popup_fields + ['geometry']
+
+    # Add the building polygons as filled blocks, one toggleable layer per risk
+    # category; only the High and Very High groups are drawn when the map opens
+    buildings_by_category = dict(tuple(gdf.groupby('_category', observed=True)))
+    layers = [
+        (category, buildings_by_category[category], category.startswith(('Very High', 'High')))
+        for category in CATEGORY_NAMES[::-1] if category in buildings_by_category
+    ]
+    # Buildings without a risk value have no category; keep them visible (gray) in their own layer
+    no_data = gdf['_category'].isna()
+    if no_data.any():
+        layers.append((NO_DATA_CATEGORY, gdf[no_data], True))
     
-    # Add the building polygon as a filled block
-    folium.GeoJson(
-        row['geometry'],
-        style_function=lambda x, color=color: {
-            'fillColor': color,
-            'color': color,  # Border color same as fill for solid block appearance
-            'weight': 0.5,   # Thin border
-            'fillOpacity': 0.85,  # More opaque for solid block appearance
-            'opacity': 1.0   # Solid border
-        },
-        popup=folium.Popup(popup_html, max_width=350),
-        tooltip=f"Percentile: {row['risk_percentile']:.1f}% | Risk: {row['expected_deaths_mean']:.3e}"
-    ).add_to(m)
+    for name, buildings, show in layers:
+        group = folium.FeatureGroup(name=name, show=show)
+        folium.GeoJson(
+            buildings[layer_columns],
+            style_function=building_style,
+            popup=folium.GeoJsonPopup(
+                fields=popup_fields,
+                aliases=popup_aliases,
+                labels=True,
+                style='background-color: white;',
+                max_width=350
+            ),
+            tooltip=folium.GeoJsonTooltip(
+                fields=['_percentile_text', '_risk_text'],
+                aliases=['Percentile:', 'Risk:']
+            )
+        ).add_to(group)
+        group.add_to(m)
 
 # Add enhanced legend with percentile information
 legend_html = f'''
@@ -241,9 +271,12 @@ plugins.Fullscreen().add_to(m)
 # Add measurement tool
 plugins.MeasureControl(position='topleft', primary_length_unit='meters').add_to(m)
 
-# Save the map
-output_path = "../Output/Maps/building_risk_percentile_map.html"
+# Save the map, a gzipped copy for serving, and the cache key
 m.save(output_path)
+with open(output_path, 'rb') as src, gzip.open(output_path + '.gz', 'wb') as dst:
+    shutil.copyfileobj(src, dst)
+with open(key_path, 'w') as f:
+    f.write(cache_key)
 
 print(f"\n{'='*60}")
 print(f"INTERACTIVE MAP GENERATED")
@@ -261,20 +294,16 @@ print("  - Fullscreen mode")
 print(f"\n{'='*60}")
 print("RISK CATEGORY DISTRIBUTION")
 print(f"{'='*60}")
-categories = [
-    ("Very High (Top 5%)", 95, 100),
-    ("High (90-95%)", 90, 95),
-    ("Elevated (75-90%)", 75, 90),
-    ("Moderate (50-75%)", 50, 75),
-    ("Low-Moderate (25-50%)", 25, 50),
-    ("Low (Bottom 25%)", 0, 25)
-]
+# One aggregation pass over the categories computed for the map; the group keys
+# are the same labels used for the map layers
+category_stats = gdf.groupby('_category', observed=False).agg(
+    n_buildings=('expected_deaths_mean', 'size'),
+    total_risk=('expected_deaths_mean', 'sum'),
+    total_occupants=('num_occupants', 'sum')
+)
 
-for name, low, high in categories:
-    count = len(gdf[(gdf['risk_percentile'] >= low) & (gdf['risk_percentile'] < high)])
-    total_risk = gdf[(gdf['risk_percentile'] >= low) & (gdf['risk_percentile'] < high)]['expected_deaths_mean'].sum()
-    total_occupants = gdf[(gdf['risk_percentile'] >= low) & (gdf['risk_percentile'] < high)]['num_occupants'].sum()
-    print(f"\n{name}:")
-    print(f"  Buildings: {count} ({count/len(gdf)*100:.1f}%)")
-    print(f"  Total expected deaths: {total_risk:.4e}")
-    print(f"  Total occupants: {total_occupants:.0f}")
+for stats in category_stats[::-1].itertuples():
+    print(f"\n{stats.Index}:")
+    print(f"  Buildings: {stats.n_buildings} ({stats.n_buildings/len(gdf)*100:.1f}%)")
+    print(f"  Total expected deaths: {stats.total_risk:.4e}")
+    print(f"  Total occupants: {stats.total_occupants:.0f}")